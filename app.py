@@ -1,34 +1,127 @@
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+    Flask, Request, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify, abort
 )
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, or_, and_
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import func, or_, and_, select, bindparam, event, case, update, lambda_stmt, literal, union_all
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable, CreateIndex
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, contains_eager, raiseload
+from collections import defaultdict
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
 from pathlib import Path
+from typing import Optional
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import unquote
+from itertools import zip_longest
 import json
+import math
+import re
+import mimetypes
+import shutil
+import tempfile
+import sqlite3
+import time
+import uuid
+import zlib
 
 # ===== App & Config =====
 app = Flask(__name__)
 app.secret_key = "dev-secret"  # change in prod
+# password hashing cost; unset keeps werkzeug's default, export e.g. PASSWORD_HASH_METHOD=pbkdf2:sha1:1000 for fast dev/test logins
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD")
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///ims.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# compiled-SQL cache (SQLAlchemy >= 1.4); sized for the app's fixed set of query shapes
+# + a persistent connection pool so requests reuse open SQLite handles
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "query_cache_size": 1200,
+    "pool_size": 10,
+    "max_overflow": 5,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+    "connect_args": {"check_same_thread": False},
+}
 
 # uploads
 APP_ROOT = Path(__file__).resolve().parent
 UPLOAD_ROOT = APP_ROOT / "uploads" / "reports"
 UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_ROOT)
-ALLOWED_REPORT_EXT = {"pdf", "doc", "docx"}
+# behind Apache or lighttpd with mod_xsendfile, export USE_X_SENDFILE=1 so the server sends download bodies
+# (nginx ignores X-Sendfile; it needs an X-Accel-Redirect location instead, so leave this off there)
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "") == "1"
+ALLOWED_REPORT_EXT = frozenset({"pdf", "doc", "docx"})
+
+# process umask, read once at import (os.umask can only be queried by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+class UploadRequest(Request):
+    """Multipart file parts spool straight into UPLOAD_ROOT (not a SpooledTemporaryFile), so keeping
+    one is a hard link rather than a second copy; unkept parts vanish when the request closes them."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile("wb+", dir=UPLOAD_ROOT, prefix=".upload-")
+
+app.request_class = UploadRequest
+
+def stored_report_name(inspection_id, filename):
+    """On-disk name for an upload; the uuid keeps same-second uploads of one filename from colliding."""
+    return f"{inspection_id}_{uuid.uuid4().hex}_{secure_filename(filename)}"
+
+def save_upload(file, path):
+    """Persist an uploaded FileStorage at ``path``: link the spooled file in place, else copy."""
+    tmp = getattr(file.stream, "name", None)
+    if isinstance(tmp, str):
+        try:
+            file.stream.flush()
+            os.link(tmp, path)
+        except OSError:
+            pass
+        else:
+            # the link shares the temp file's inode, which mkstemp made 0600; give it the mode
+            # file.save() would (no copy fallback here: saving over the link would truncate the source)
+            try:
+                os.chmod(path, 0o666 & ~_UMASK)
+            except OSError:
+                app.logger.warning(f"Could not set permissions on {path}")
+            return
+    file.save(path)
 
 # simple depreciation schedule (cap at 70%)
 # You can tune these numbers without code changes.
 app.config["DEPR_RULE"] = dict(Y1=10.0, Y2=8.0, Y3=7.0, Y4PLUS=5.0, CAP=70.0)
 
+# rows per dashboard status tab
+app.config["DASHBOARD_PAGE_SIZE"] = 50
+
+# compiled template bytecode kept on disk, so restarted workers skip re-parsing templates/*.html
+# (Flask already turns template auto-reload off outside debug mode)
+JINJA_CACHE = Path(app.instance_path) / "jinja_cache"
+JINJA_CACHE.mkdir(parents=True, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(JINJA_CACHE))
+
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_con, _record):
+    """WAL + relaxed fsync for every new SQLite connection (no-op for other backends)."""
+    if not isinstance(dbapi_con, sqlite3.Connection):
+        return
+    cur = dbapi_con.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-65536")     # 64 MiB page cache
+    cur.execute("PRAGMA mmap_size=268435456")   # 256 MiB memory-mapped reads
+    cur.execute("PRAGMA foreign_keys=ON")  # needed for ON DELETE CASCADE / SET NULL
+    cur.close()
+
 # ===== Enums =====
 class Role:
     ADMIN = "ADMIN"
@@ -114,24 +207,25 @@ class Inspection(db.Model):
     public_id = db.Column(db.String(40), unique=True, index=True)
     seq_num = db.Column(db.Integer)  # sequence within type-year
 
-    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     inspection_type = db.Column(db.String(20), default=InspectionType.PSIC, nullable=False)
 
-    client_id = db.Column(db.Integer, db.ForeignKey("client.id"))
-    client = db.relationship("Client")
+    client_id = db.Column(db.Integer, db.ForeignKey("client.id", ondelete="SET NULL"), index=True)
+    # lazy="raise_on_sql": routes must eager-load these (see INSPECTION_REFS) instead of N+1 lazy loads
+    client = db.relationship("Client", lazy="raise_on_sql")
 
     location = db.Column(db.String(200))
     asset = db.Column(db.String(200))
 
     # Universal: CHA / Forwarder + commission override
-    cha_id = db.Column(db.Integer, db.ForeignKey("cha.id"))
-    cha = db.relationship("CHA")
+    cha_id = db.Column(db.Integer, db.ForeignKey("cha.id", ondelete="SET NULL"), index=True)
+    cha = db.relationship("CHA", lazy="raise_on_sql")
     forwarder_name = db.Column(db.String(160))
     cha_commission_pct = db.Column(db.Float)  # optional override of CHA.commission_rate
 
-    status = db.Column(db.String(40), default=InspectionStatus.DRAFT)
-    engineer_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    engineer = db.relationship("User")
+    status = db.Column(db.String(40), default=InspectionStatus.DRAFT, index=True)
+    engineer_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), index=True)
+    engineer = db.relationship("User", lazy="raise_on_sql")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # ---- PSIC fields ----
@@ -153,11 +247,18 @@ class Inspection(db.Model):
     condition_notes = db.Column(db.Text)
     fair_market_value = db.Column(db.Float)
 
+    # notifications: status == X AND date < Y
+    __table_args__ = (
+        db.Index("ix_inspection_status_date", "status", "date"),
+        db.Index("ix_inspection_type_date", "inspection_type", "date"),  # public-id seeding, type filters
+    )
+
 class Report(db.Model):
     __tablename__ = "report"
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id"), unique=True)
-    inspection = db.relationship("Inspection", backref=db.backref("report", uselist=False))
+    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id", ondelete="CASCADE"), unique=True)
+    inspection = db.relationship("Inspection", lazy="raise_on_sql", backref=db.backref(
+        "report", uselist=False, cascade="all, delete-orphan", passive_deletes=True))
     status = db.Column(db.String(20), default=ReportStatus.DRAFT)
     body = db.Column(db.Text)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -165,35 +266,42 @@ class Report(db.Model):
 class ReportFile(db.Model):
     __tablename__ = "report_file"
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id"))
-    inspection = db.relationship("Inspection", backref=db.backref("files", lazy="dynamic"))
-    uploader_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id", ondelete="CASCADE"))
+    inspection = db.relationship("Inspection", lazy="raise_on_sql", backref=db.backref(
+        "files", lazy="dynamic", cascade="all, delete-orphan", passive_deletes=True))
+    uploader_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"))
     uploader = db.relationship("User")
     stored_name = db.Column(db.String(255))   # on-disk filename
     original_name = db.Column(db.String(255))
     mimetype = db.Column(db.String(80))
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_reportfile_inspection_uploaded", "inspection_id", db.desc("uploaded_at")),  # latest file per inspection
+    )
+
 class Invoice(db.Model):
     __tablename__ = "invoice"
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id"), unique=True)
-    inspection = db.relationship("Inspection", backref=db.backref("invoice", uselist=False))
+    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id", ondelete="CASCADE"), unique=True)
+    inspection = db.relationship("Inspection", lazy="raise_on_sql", backref=db.backref(
+        "invoice", uselist=False, cascade="all, delete-orphan", passive_deletes=True))
     fee = db.Column(db.Float, default=0.0)
     tax_pct = db.Column(db.Float, default=18.0)
     total = db.Column(db.Float, default=0.0)
-    status = db.Column(db.String(20), default=InvoiceStatus.DRAFT)
+    status = db.Column(db.String(20), default=InvoiceStatus.DRAFT, index=True)
     notes = db.Column(db.Text)
 
 class Commission(db.Model):
     __tablename__ = "commission"
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id"), unique=True)
-    inspection = db.relationship("Inspection", backref=db.backref("commission", uselist=False))
-    cha_id = db.Column(db.Integer, db.ForeignKey("cha.id"))
+    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id", ondelete="CASCADE"), unique=True)
+    inspection = db.relationship("Inspection", lazy="raise_on_sql", backref=db.backref(
+        "commission", uselist=False, cascade="all, delete-orphan", passive_deletes=True))
+    cha_id = db.Column(db.Integer, db.ForeignKey("cha.id", ondelete="SET NULL"), index=True)
     cha = db.relationship("CHA")
     amount = db.Column(db.Float, default=0.0)
-    status = db.Column(db.String(20), default=CommissionStatus.DUE)
+    status = db.Column(db.String(20), default=CommissionStatus.DUE, index=True)
 
 class Template(db.Model):
     __tablename__ = "template"
@@ -202,12 +310,14 @@ class Template(db.Model):
     active = db.Column(db.Boolean, default=True)
     ai_prompt = db.Column(db.Text)
     html_snippet = db.Column(db.Text)
+    html_snippet_compiled = db.Column(db.Text)  # html_snippet as a str.format_map template
 
 class Annexure(db.Model):
     __tablename__ = "annexure"
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id"))
-    inspection = db.relationship("Inspection", backref=db.backref("annexures", lazy="dynamic"))
+    inspection_id = db.Column(db.Integer, db.ForeignKey("inspection.id", ondelete="CASCADE"))
+    inspection = db.relationship("Inspection", lazy="raise_on_sql", backref=db.backref(
+        "annexures", lazy="dynamic", cascade="all, delete-orphan", passive_deletes=True))
 
     sno = db.Column(db.Integer)
     description = db.Column(db.Text)
@@ -233,6 +343,33 @@ class AuditLog(db.Model):
     ip = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+class SequenceCounter(db.Model):
+    """Last Inspection.seq_num handed out per (inspection_type, year)."""
+    __tablename__ = "sequence_counter"
+    inspection_type = db.Column(db.String(20), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+
+# ===== Prepared statements =====
+# Built once at import; bound params keep the compiled-SQL cache key stable across requests.
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+REPORT_BY_INSPECTION = select(Report).where(Report.inspection_id == bindparam("inspection_id"))
+INVOICE_BY_INSPECTION = select(Invoice).where(Invoice.inspection_id == bindparam("inspection_id"))
+def strict_loading():
+    """raiseload("*") under debug/testing: list views must declare every relation they touch."""
+    return (raiseload("*"),) if app.debug or app.testing else ()
+
+# eager loads for pages that show an inspection's client / CHA / engineer
+INSPECTION_REFS = (joinedload(Inspection.client), joinedload(Inspection.cha), joinedload(Inspection.engineer))
+# dashboard card columns, and the status tab each inspection falls under (legacy statuses -> DRAFT)
+DASHBOARD_COLUMNS = (
+    Inspection.id, Inspection.public_id, Inspection.date, Inspection.status,
+    Inspection.location, Inspection.asset, Inspection.inspection_type,
+    Client.name.label("client_name"), User.name.label("eng_name"),
+)
+DASHBOARD_BUCKET = case((Inspection.status.in_(InspectionStatus.ALL), Inspection.status),
+                        else_=InspectionStatus.DRAFT)
+
 # ===== Helpers =====
 def role_required(*roles):
     def deco(fn):
@@ -249,28 +386,72 @@ def role_required(*roles):
         return wrap
     return deco
 
+# Money math runs on integer paise and percentages in basis points, so results are exact
+# (half-up to the paisa) instead of depending on float rounding; columns still store rupees.
+def to_paise(amount) -> int:
+    return int(round((amount or 0) * 100))
+
+def finite_float(value) -> float:
+    """float(value), but NaN / inf raise ValueError like any other bad number (to_paise can't take them)."""
+    f = float(value)
+    if not math.isfinite(f):
+        raise ValueError(f"not a finite number: {value!r}")
+    return f
+
+def pct_of_paise(paise: int, pct) -> int:
+    """pct% of an amount in paise, rounded half-up to the paisa."""
+    return (paise * to_paise(pct) + 5000) // 10000
+
 def calc_total(fee, tax_pct):
-    return round((fee or 0.0) * (1 + (tax_pct or 0)/100.0), 2)
+    p = to_paise(fee)
+    return (p + pct_of_paise(p, tax_pct)) / 100
+
+def residual_value(cif, dep_pct):
+    p = to_paise(cif)
+    return max(0, p - pct_of_paise(p, dep_pct)) / 100
+
+def calc_totals_bulk(fees, tax_pcts):
+    """calc_total over parallel sequences in one pass (same rounding as the scalar version)."""
+    return [calc_total(f, t) for f, t in zip(fees, tax_pcts)]
 
 def ensure_report(inspection_id):
-    rep = Report.query.filter_by(inspection_id=inspection_id).first()
+    rep = db.session.execute(REPORT_BY_INSPECTION, {"inspection_id": inspection_id}).scalar_one_or_none()
     if not rep:
-        rep = Report(inspection_id=inspection_id, status=ReportStatus.DRAFT, body="")
-        db.session.add(rep); db.session.commit()
+        # ON CONFLICT DO NOTHING: a concurrent request creating the same row is not an error
+        db.session.execute(
+            sqlite_insert(Report)
+            .values(inspection_id=inspection_id, status=ReportStatus.DRAFT, body="")
+            .on_conflict_do_nothing(index_elements=["inspection_id"])
+        )
+        db.session.commit()
+        rep = db.session.execute(REPORT_BY_INSPECTION, {"inspection_id": inspection_id}).scalar_one()
     return rep
 
 def ensure_invoice(inspection_id, fee=0.0, tax_pct=18.0):
-    inv = Invoice.query.filter_by(inspection_id=inspection_id).first()
+    inv = db.session.execute(INVOICE_BY_INSPECTION, {"inspection_id": inspection_id}).scalar_one_or_none()
     if not inv:
-        inv = Invoice(inspection_id=inspection_id, fee=fee, tax_pct=tax_pct, total=calc_total(fee, tax_pct))
-        db.session.add(inv); db.session.commit()
+        db.session.execute(
+            sqlite_insert(Invoice)
+            .values(inspection_id=inspection_id, fee=fee, tax_pct=tax_pct, total=calc_total(fee, tax_pct))
+            .on_conflict_do_nothing(index_elements=["inspection_id"])
+        )
+        db.session.commit()
+        inv = db.session.execute(INVOICE_BY_INSPECTION, {"inspection_id": inspection_id}).scalar_one()
     return inv
 
+# {{placeholder}} names supported in Template.html_snippet
+AI_PLACEHOLDERS = ("client", "location", "asset", "engineer", "findings")
+# a known {{placeholder}}, or any other single brace (to be escaped)
+_AI_PAT = re.compile(r"\{\{(" + "|".join(AI_PLACEHOLDERS) + r")\}\}|[{}]")
+
+def compile_snippet(html: str) -> str:
+    """Translate {{client}}-style placeholders to {client}; every other brace is escaped for format_map."""
+    return _AI_PAT.sub(lambda m: "{" + m.group(1) + "}" if m.group(1) else m.group(0) * 2, html or "")
+
 def allowed_report_file(filename: str) -> bool:
-    if not filename or "." not in filename:
-        return False
-    ext = filename.rsplit(".", 1)[1].lower()
-    return ext in ALLOWED_REPORT_EXT
+    # one hash lookup on the lowercased extension only
+    dot = filename.rfind(".") if filename else -1
+    return dot >= 0 and filename[dot + 1:].lower() in ALLOWED_REPORT_EXT
 
 def generate_public_id(i: "Inspection"):
     """Generate and assign public_id and seq_num for an inspection if missing."""
@@ -278,17 +459,42 @@ def generate_public_id(i: "Inspection"):
         return
     year = (i.date or datetime.utcnow()).year
     type_token = InspectionType.CODE_TO_ID_TOKEN.get(i.inspection_type, "GEN")
-    # Find max seq for this type-year
-    max_seq = (
-        db.session.query(func.max(Inspection.seq_num))
-        .filter(and_(Inspection.inspection_type == i.inspection_type,
-                     func.strftime('%Y', Inspection.date) == str(year)))
-        .scalar()
-    )
-    next_seq = (max_seq or 0) + 1
+    # bump the type-year counter atomically (UPDATE ... RETURNING)
+    next_seq = db.session.execute(
+        update(SequenceCounter)
+        .where(SequenceCounter.inspection_type == i.inspection_type, SequenceCounter.year == year)
+        .values(last_seq=SequenceCounter.last_seq + 1)
+        .returning(SequenceCounter.last_seq)
+    ).scalar()
+    if next_seq is None:
+        # first id for this type-year since the counter existed: seed it from the existing rows once
+        max_seq = (
+            db.session.query(func.max(Inspection.seq_num))
+            .filter(and_(Inspection.inspection_type == i.inspection_type,
+                         func.strftime('%Y', Inspection.date) == str(year)))
+            .scalar()
+        )
+        stmt = sqlite_insert(SequenceCounter).values(
+            inspection_type=i.inspection_type, year=year, last_seq=(max_seq or 0) + 1)
+        next_seq = db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["inspection_type", "year"],
+                set_={"last_seq": SequenceCounter.last_seq + 1})
+            .returning(SequenceCounter.last_seq)
+        ).scalar_one()
     i.seq_num = next_seq
     i.public_id = f"INS-{type_token}-{year}-{next_seq:03d}"
 
+def backfill_public_ids():
+    """Give legacy inspections without a public_id one, oldest first, in a single commit (boot-time)."""
+    legacy = Inspection.query.filter(Inspection.public_id.is_(None)).order_by(Inspection.date, Inspection.id).all()
+    if not legacy:
+        return
+    with bulk_commit():
+        for i in legacy:
+            generate_public_id(i)
+    app.logger.info(f"Assigned public ids to {len(legacy)} legacy inspections")
+
 def compute_depreciation_pct(year_of_manufacture: int, on_date: datetime) -> float:
     """Very simple piecewise yearly schedule, capped. Tunable via app.config['DEPR_RULE']."""
     if not year_of_manufacture:
@@ -306,31 +512,124 @@ def compute_depreciation_pct(year_of_manufacture: int, on_date: datetime) -> flo
         pct += r["Y4PLUS"] * (years - 3)
     return min(pct, r["CAP"])
 
-def upsert_commission_from_inspection(i: "Inspection"):
-    """Create or update a Commission row based on invoice fee and CHA rate / override."""
-    rate = None
-    if i.cha_commission_pct is not None:
-        rate = i.cha_commission_pct
-    elif i.cha and i.cha.commission_rate is not None:
-        rate = i.cha.commission_rate
-    else:
-        rate = 0.0
-    fee = i.invoice.fee if getattr(i, "invoice", None) else 0.0
-    amount = round((fee or 0.0) * (rate or 0.0) / 100.0, 2)
-    com = Commission.query.filter_by(inspection_id=i.id).first()
-    if not com:
-        com = Commission(inspection_id=i.id, cha_id=i.cha_id, amount=amount, status=CommissionStatus.DUE)
-        db.session.add(com)
-    else:
-        com.cha_id = i.cha_id
-        com.amount = amount
+def upsert_commission_from_inspection(i: "Inspection", fee: Optional[float]):
+    """Create or update a Commission row based on invoice fee and CHA rate / override.
+
+    ``fee`` is the invoice fee (None if there is no invoice); callers read it so nothing here lazy-loads.
+    Commits the session, including any pending changes from the caller.
+    """
+    cha_rate = None
+    if i.cha_commission_pct is None and i.cha_id and (cha := db.session.get(CHA, i.cha_id)):
+        cha_rate = cha.commission_rate
+    db.session.execute(commission_upsert([dict(
+        inspection_id=i.id, cha_id=i.cha_id, status=CommissionStatus.DUE,
+        amount=commission_amount(fee, i.cha_commission_pct, cha_rate),
+    )]))
     db.session.commit()
 
+def commission_amount(fee, override_pct, cha_rate):
+    """Invoice fee x rate, where the inspection's override beats the CHA's rate (0 if neither is set)."""
+    rate = override_pct if override_pct is not None else (cha_rate if cha_rate is not None else 0.0)
+    return pct_of_paise(to_paise(fee), rate) / 100
+
+def commission_upsert(rows):
+    """Single INSERT ... ON CONFLICT(inspection_id) DO UPDATE for Commission rows; keeps status on update."""
+    stmt = sqlite_insert(Commission).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["inspection_id"],
+        set_={"cha_id": stmt.excluded.cha_id, "amount": stmt.excluded.amount},
+    )
+
+COMMISSION_UPSERT_BATCH = 500  # rows per statement, well under SQLite's bound-parameter limit
+
+def bulk_upsert_commissions(inspection_ids):
+    """upsert_commission_from_inspection for many inspections: one read, one upsert per batch, one commit."""
+    ids = list(inspection_ids)
+    if not ids:
+        return 0
+    src = (
+        db.session.query(Inspection.id, Inspection.cha_id, Inspection.cha_commission_pct,
+                         CHA.commission_rate, Invoice.fee)
+        .outerjoin(CHA, Inspection.cha_id == CHA.id)
+        .outerjoin(Invoice, Invoice.inspection_id == Inspection.id)
+        .filter(Inspection.id.in_(ids))
+        .all()
+    )
+    rows = [
+        dict(inspection_id=r.id, cha_id=r.cha_id, status=CommissionStatus.DUE,
+             amount=commission_amount(r.fee, r.cha_commission_pct, r.commission_rate))
+        for r in src
+    ]
+    with bulk_commit():
+        for n in range(0, len(rows), COMMISSION_UPSERT_BATCH):
+            db.session.execute(commission_upsert(rows[n:n + COMMISSION_UPSERT_BATCH]))
+    return len(rows)
+
+@contextmanager
+def bulk_commit():
+    """Group many adds into one transaction: a single commit (one fsync) on success, rollback on error."""
+    try:
+        yield db.session
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+# Dropdown lookups (engineers, clients, CHAs) change rarely; keep (id, name) rows in-process.
+LOOKUP_TTL = 30  # seconds
+_lookup_cache = {}  # key -> (loaded_at, rows)
+
+def cached_lookup(key, load):
+    """Return load() for key, re-running it at most every LOOKUP_TTL seconds."""
+    now = time.monotonic()
+    hit = _lookup_cache.get(key)
+    if hit is None or now - hit[0] > LOOKUP_TTL:
+        hit = (now, load())
+        _lookup_cache[key] = hit
+    return hit[1]
+
+def invalidate_lookup(*keys):
+    for key in keys:
+        _lookup_cache.pop(key, None)
+
+def engineers_list():
+    return cached_lookup("engineers", lambda: (
+        db.session.query(User.id, User.name).filter(User.role == Role.ENGINEER).all()
+    ))
+
+def clients_lookup():
+    return cached_lookup("clients", lambda: db.session.query(Client.id, Client.name).order_by(Client.name.asc()).all())
+
+def chas_lookup():
+    return cached_lookup("chas", lambda: db.session.query(CHA.id, CHA.name).order_by(CHA.name.asc()).all())
+
+# Whether any account exists: monotonic (users are never deleted), so once True it stays cached.
+_HAS_USERS = False
+
+def has_users():
+    global _HAS_USERS
+    if not _HAS_USERS:
+        _HAS_USERS = db.session.query(User.id).limit(1).scalar() is not None
+    return _HAS_USERS
+
+def _load_active_template():
+    row = db.session.query(Template.html_snippet, Template.html_snippet_compiled).filter_by(active=True).first()
+    return "" if not row or not row.html_snippet else (row.html_snippet_compiled or compile_snippet(row.html_snippet))
+
+def get_active_template():
+    """Compiled html_snippet of the first active template ("" if none).
+
+    Cached like the dropdown lookups: templates_mgmt invalidates it on write, and the
+    TTL bounds staleness in other worker processes that did not see that write.
+    """
+    return cached_lookup("active_template", _load_active_template)
+
 def _client_ip():
     # works behind proxies/load balancers if you set X-Forwarded-For
     return request.headers.get("X-Forwarded-For", request.remote_addr)
 
 def log_action(action, entity, entity_id, changes=None):
+    """Stage an AuditLog row; it is committed with the caller's change."""
     try:
         log = AuditLog(
             user_id=session.get("user_id"),
@@ -341,30 +640,66 @@ def log_action(action, entity, entity_id, changes=None):
             ip=_client_ip(),
         )
         db.session.add(log)
-        db.session.commit()
     except Exception as e:
         app.logger.warning(f"AuditLog failed: {e}")
 
+def hash_method_kw():
+    """method= for generate_password_hash only when PASSWORD_HASH_METHOD is set (else werkzeug's default)."""
+    m = app.config["PASSWORD_HASH_METHOD"]
+    return {"method": m} if m else {}
+
+def form_float(key):
+    """request.form[key] as a float, None when missing or blank (one form lookup)."""
+    v = request.form.get(key)
+    return finite_float(v) if v else None
+
+def form_int(key):
+    """request.form[key] as an int, None when missing or blank (one form lookup)."""
+    v = request.form.get(key)
+    return int(v) if v else None
+
+# type-specific Inspection columns and how each form value is parsed; blank -> None
+TYPE_FIELDS = {
+    InspectionType.PSIC: (("scrap_type", str), ("container_count", int),
+                          ("container_weight", finite_float), ("container_notes", str)),
+    InspectionType.CE_VAL: (("machinery_type", str), ("year_of_manufacture", int),
+                            ("original_cif_value", finite_float), ("balance_useful_life", str)),
+    InspectionType.CE_FIT: (("goods_details", str), ("condition_notes", str),
+                            ("fair_market_value", finite_float)),
+}
+
+def apply_type_fields(i: "Inspection"):
+    """Set the columns for i.inspection_type from request.form (one lookup per field)."""
+    form = request.form
+    for name, cast in TYPE_FIELDS.get(i.inspection_type, ()):
+        v = form.get(name)
+        setattr(i, name, (v if cast is str else cast(v)) if v else None)
+
 def dict_diff(before: dict, after: dict):
     """Return {field: [old, new]} for changed fields only."""
     diff = {}
-    for k in set(before.keys()) | set(after.keys()):
-        if before.get(k) != after.get(k):
-            diff[k] = [before.get(k), after.get(k)]
+    for k, new in after.items():
+        old = before.get(k)
+        if old != new:
+            diff[k] = [old, new]
+    # keys dropped in `after` count as changed to None (as .get() would report them)
+    for k, old in before.items():
+        if old is not None and k not in after:
+            diff[k] = [old, None]
     return diff
 
-@app.context_processor
-def inject_globals():
-    return dict(
-        Role=Role, InspectionStatus=InspectionStatus, InvoiceStatus=InvoiceStatus,
-        ReportStatus=ReportStatus, CommissionStatus=CommissionStatus, now=datetime.utcnow,
-        User=User, InspectionType=InspectionType
-    )
+# registered once as Jinja globals: no context processor has to run (and merge a dict) on every render
+_TEMPLATE_GLOBALS = dict(
+    Role=Role, InspectionStatus=InspectionStatus, InvoiceStatus=InvoiceStatus,
+    ReportStatus=ReportStatus, CommissionStatus=CommissionStatus, now=datetime.utcnow,
+    User=User, InspectionType=InspectionType
+)
+app.jinja_env.globals.update(_TEMPLATE_GLOBALS)
 
 # ===== Auth =====
 @app.route("/register", methods=["GET","POST"])
 def register():
-    first_user = (User.query.first() is None)
+    first_user = not has_users()
     is_admin = (session.get("role") == Role.ADMIN)
     can_choose_role = first_user or is_admin
 
@@ -380,14 +715,15 @@ def register():
         else:
             role = Role.ENGINEER
 
-        if User.query.filter_by(email=email).first():
+        if db.session.execute(USER_BY_EMAIL, {"email": email}).scalar_one_or_none():
             flash("Email already registered.", "danger")
             return redirect(url_for("register"))
 
         u = User(name=name, email=email,
-                 password_hash=generate_password_hash(pwd),
+                 password_hash=generate_password_hash(pwd, **hash_method_kw()),
                  role=role)
         db.session.add(u); db.session.commit()
+        invalidate_lookup("engineers")
         flash("Registered. Please login.", "success")
         return redirect(url_for("login"))
 
@@ -399,7 +735,7 @@ def login():
     if request.method == "POST":
         email = request.form.get("email","").strip().lower()
         pwd = request.form.get("password","")
-        u = User.query.filter_by(email=email).first()
+        u = db.session.execute(USER_BY_EMAIL, {"email": email}).scalar_one_or_none()
         if u and check_password_hash(u.password_hash, pwd):
             session["user_id"] = u.id
             session["role"] = u.role
@@ -425,6 +761,7 @@ def users_admin():
         u = User.query.get_or_404(uid)
         u.role = role
         db.session.commit()
+        invalidate_lookup("engineers")
         flash("Role updated.", "success")
         return redirect(url_for("users_admin"))
     users = User.query.order_by(User.id.asc()).all()
@@ -442,6 +779,7 @@ def clients_list():
             flash("Name required.", "warning"); return redirect(url_for("clients_list"))
         db.session.add(Client(name=name, gst_number=gst, billing_address=addr))
         db.session.commit()
+        invalidate_lookup("clients")
         flash("Client added.", "success")
         return redirect(url_for("clients_list"))
     data = Client.query.order_by(Client.name.asc()).all()
@@ -452,6 +790,7 @@ def clients_list():
 def clients_delete(cid):
     obj = Client.query.get_or_404(cid)
     db.session.delete(obj); db.session.commit()
+    invalidate_lookup("clients")
     flash("Client deleted.", "info")
     return redirect(url_for("clients_list"))
 
@@ -472,6 +811,7 @@ def clients_update(cid):
     c.gst_number = gst
     c.billing_address = addr
     db.session.commit()
+    invalidate_lookup("clients")
     flash("Client updated.", "success")
     return redirect(url_for("clients_list"))
 
@@ -482,11 +822,15 @@ def chas_list():
     if request.method == "POST":
         name = request.form["name"].strip()
         contact = request.form.get("contact","")
-        rate = float(request.form.get("commission_rate", 0))
+        try:
+            rate = finite_float(request.form.get("commission_rate", 0))
+        except ValueError:
+            flash("Invalid commission rate.", "warning"); return redirect(url_for("chas_list"))
         if not name:
             flash("Name required.", "warning"); return redirect(url_for("chas_list"))
         db.session.add(CHA(name=name, contact=contact, commission_rate=rate))
         db.session.commit()
+        invalidate_lookup("chas")
         flash("CHA added.", "success")
         return redirect(url_for("chas_list"))
     data = CHA.query.order_by(CHA.name.asc()).all()
@@ -497,6 +841,7 @@ def chas_list():
 def chas_delete(cha_id):
     obj = CHA.query.get_or_404(cha_id)
     db.session.delete(obj); db.session.commit()
+    invalidate_lookup("chas")
     flash("CHA deleted.", "info")
     return redirect(url_for("chas_list"))
 
@@ -508,11 +853,12 @@ def chas_update(cha_id):
     obj.name = request.form.get("name", obj.name).strip()
     obj.contact = request.form.get("contact", obj.contact)
     try:
-        rate = float(request.form.get("commission_rate", obj.commission_rate or 0))
+        rate = finite_float(request.form.get("commission_rate", obj.commission_rate or 0))
         obj.commission_rate = max(0.0, min(rate, 100.0))
     except ValueError:
         flash("Invalid commission rate.", "warning"); return redirect(url_for("chas_list"))
     db.session.commit()
+    invalidate_lookup("chas")
     flash("CHA updated.", "success")
     return redirect(url_for("chas_list"))
 
@@ -527,45 +873,68 @@ def dashboard():
     eng_id = request.args.get("engineer_id")
     q = request.args.get("q")
 
-    qry = Inspection.query
-    # Inclusive start
-    if date_from:
-        df = datetime.fromisoformat(date_from)
-        qry = qry.filter(Inspection.date >= df)
-    # Inclusive end for whole-day inputs
-    if date_to:
-        dt = datetime.fromisoformat(date_to)
-        if len(date_to) == 10:  # yyyy-mm-dd
-            dt = dt + timedelta(days=1)
-            qry = qry.filter(Inspection.date < dt)
-        else:
-            qry = qry.filter(Inspection.date <= dt)
-
-    if status:
-        qry = qry.filter(Inspection.status == status)
-    if cha_id:
-        qry = qry.filter(Inspection.cha_id == int(cha_id))
-    if eng_id:
-        qry = qry.filter(Inspection.engineer_id == int(eng_id))
-    if q:
-        like = f"%{q}%"
-        qry = qry.join(Client).filter(or_(
-            Client.name.ilike(like), Inspection.location.ilike(like),
-            Inspection.asset.ilike(like), Inspection.public_id.ilike(like)
-        ))
-
-    inspections = qry.order_by(Inspection.date.desc()).all()
-    groups = {s: [] for s in InspectionStatus.ALL}
-    for i in inspections:
-        if i.status in groups:
-            groups[i.status].append(i)
-        else:
-            groups[InspectionStatus.DRAFT].append(i)  # bucket legacy
-
-    chas = CHA.query.all()
-    engineers = User.query.filter(User.role == Role.ENGINEER).all()
-    clients = Client.query.all()
-    return render_template("dashboard.html", groups=groups, chas=chas, engineers=engineers, clients=clients)
+    df = datetime.fromisoformat(date_from) if date_from else None
+    dt = datetime.fromisoformat(date_to) if date_to else None
+    whole_day = bool(date_to) and len(date_to) == 10  # yyyy-mm-dd
+    if whole_day:
+        dt = dt + timedelta(days=1)
+    cha = int(cha_id) if cha_id else None
+    eng = int(eng_id) if eng_id else None
+    like = f"%{q}%" if q else None
+
+    def filtered(stmt):
+        # each filter is its own lambda, so the compiled SQL is cached per combination of filters present
+        # Inclusive start
+        if df is not None:
+            stmt += lambda s: s.where(Inspection.date >= df)
+        # Inclusive end for whole-day inputs
+        if dt is not None and whole_day:
+            stmt += lambda s: s.where(Inspection.date < dt)
+        elif dt is not None:
+            stmt += lambda s: s.where(Inspection.date <= dt)
+        if cha is not None:
+            stmt += lambda s: s.where(Inspection.cha_id == cha)
+        if eng is not None:
+            stmt += lambda s: s.where(Inspection.engineer_id == eng)
+        if like is not None:
+            stmt += lambda s: s.where(or_(
+                Client.name.ilike(like), Inspection.location.ilike(like),
+                Inspection.asset.ilike(like), Inspection.public_id.ilike(like)
+            ))
+        return stmt
+
+    # tab counts come from one GROUP BY; legacy statuses fold into DRAFT as before
+    found = dict(db.session.execute(filtered(lambda_stmt(
+        lambda: select(DASHBOARD_BUCKET, func.count(Inspection.id))
+        .select_from(Inspection)
+        .outerjoin(Client, Inspection.client_id == Client.id)
+    )) + (lambda s: s.group_by(DASHBOARD_BUCKET))).all())
+    counts = {s: found.get(s, 0) for s in InspectionStatus.ALL}
+
+    # only the active tab's rows are fetched, one page at a time
+    if status in counts:
+        active = status
+    else:
+        active = next((s for s in InspectionStatus.ALL if counts[s]), InspectionStatus.DRAFT)
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = app.config["DASHBOARD_PAGE_SIZE"]
+    offset = (page - 1) * per_page
+    # the cards only render a handful of fields: fetch plain column tuples, no ORM objects
+    rows = db.session.execute(filtered(lambda_stmt(
+        lambda: select(*DASHBOARD_COLUMNS)
+        .select_from(Inspection)
+        .outerjoin(Client, Inspection.client_id == Client.id)
+        .outerjoin(User, Inspection.engineer_id == User.id)
+    )) + (lambda s: s.where(DASHBOARD_BUCKET == active)
+          .order_by(Inspection.date.desc())
+          .limit(per_page).offset(offset))).all()
+
+    chas = chas_lookup()
+    engineers = engineers_list()
+    clients = clients_lookup()
+    return render_template("dashboard.html", counts=counts, active=active, rows=rows,
+                           page=page, per_page=per_page,
+                           chas=chas, engineers=engineers, clients=clients)
 
 @app.route("/search")
 @role_required(Role.ADMIN, Role.ENGINEER, Role.ACCOUNTANT)
@@ -574,9 +943,13 @@ def global_search():
     like = f"%{q}%"
     inspections = Inspection.query.join(Client).filter(
         or_(Client.name.ilike(like), Inspection.location.ilike(like), Inspection.asset.ilike(like), Inspection.public_id.ilike(like))
-    ).all()
+    ).options(contains_eager(Inspection.client)).all()
     clients = Client.query.filter(Client.name.ilike(like)).all()
-    invoices = Invoice.query.join(Inspection).join(Client).filter(Client.name.ilike(like)).all()
+    invoices = (
+        Invoice.query.join(Inspection).join(Client).filter(Client.name.ilike(like))
+        .options(contains_eager(Invoice.inspection).contains_eager(Inspection.client))
+        .all()
+    )
     return render_template("search_results.html", q=q, inspections=inspections, clients=clients, invoices=invoices)
 
 # ===== Inspections =====
@@ -599,68 +972,59 @@ def inspection_create():
         cha_id=int(request.form["cha_id"]) if request.form.get("cha_id") else None,
         inspection_type=request.form.get("inspection_type", InspectionType.PSIC),
         forwarder_name=request.form.get("forwarder_name","").strip() or None,
-        cha_commission_pct=(float(request.form.get("cha_commission_pct")) if request.form.get("cha_commission_pct") else None),
+        cha_commission_pct=form_float("cha_commission_pct"),
     )
 
     # type-specific fields
-    t = i.inspection_type
-    if t == InspectionType.PSIC:
-        i.scrap_type = request.form.get("scrap_type") or None
-        i.container_count = (int(request.form.get("container_count")) if request.form.get("container_count") else None)
-        i.container_weight = (float(request.form.get("container_weight")) if request.form.get("container_weight") else None)
-        i.container_notes = request.form.get("container_notes") or None
-
-    elif t == InspectionType.CE_VAL:
-        i.machinery_type = request.form.get("machinery_type") or None
-        i.year_of_manufacture = (int(request.form.get("year_of_manufacture")) if request.form.get("year_of_manufacture") else None)
-        i.original_cif_value = (float(request.form.get("original_cif_value")) if request.form.get("original_cif_value") else None)
+    apply_type_fields(i)
+    if i.inspection_type == InspectionType.CE_VAL:
         # auto depreciation and residual
         dep_pct = compute_depreciation_pct(i.year_of_manufacture or 0, i.date)
         i.depreciation_pct = dep_pct
         if i.original_cif_value is not None:
-            i.residual_value = round(max(0.0, (i.original_cif_value or 0.0) * (1 - dep_pct/100.0)), 2)
-        i.balance_useful_life = request.form.get("balance_useful_life") or None
-
-    elif t == InspectionType.CE_FIT:
-        i.goods_details = request.form.get("goods_details") or None
-        i.condition_notes = request.form.get("condition_notes") or None
-        i.fair_market_value = (float(request.form.get("fair_market_value")) if request.form.get("fair_market_value") else None)
-
-    db.session.add(i)
-    db.session.commit()
-
-    # assign public id
-    generate_public_id(i)
-    db.session.commit()
-    log_action("create", "inspection", i.id, changes={"form": request.form.to_dict(flat=True), "public_id": i.public_id})
-
-    # ===== Annexure handling (for CE inspections only) =====
-    if i.inspection_type in [InspectionType.CE_VAL, InspectionType.CE_FIT]:
-        annexure_snos = request.form.getlist("annexure_sno[]")
-        annexure_descs = request.form.getlist("annexure_description[]")
-        annexure_qtys = request.form.getlist("annexure_qty[]")
-        annexure_mfrs = request.form.getlist("annexure_manufacturer[]")
-        annexure_marks = request.form.getlist("annexure_markings[]")
-        annexure_yoms = request.form.getlist("annexure_yom[]")
-        annexure_unit_vals = request.form.getlist("annexure_unit_invoice_value[]")
-        annexure_total_vals = request.form.getlist("annexure_total_invoice_value[]")
-
-        for idx in range(len(annexure_descs)):
-            if annexure_descs[idx].strip():  # only save if description is filled
-                a = Annexure(
+            i.residual_value = residual_value(i.original_cif_value, dep_pct)
+
+    # inspection, public id, audit row and annexures share one transaction (one commit)
+    with bulk_commit():
+        db.session.add(i)
+        db.session.flush()  # assigns i.id without committing
+
+        # assign public id
+        generate_public_id(i)
+        log_action("create", "inspection", i.id, changes={"form": request.form.to_dict(flat=True), "public_id": i.public_id})
+
+        # ===== Annexure handling (for CE inspections only) =====
+        if i.inspection_type in [InspectionType.CE_VAL, InspectionType.CE_FIT]:
+            annexure_snos = request.form.getlist("annexure_sno[]")
+            annexure_descs = request.form.getlist("annexure_description[]")
+            annexure_qtys = request.form.getlist("annexure_qty[]")
+            annexure_mfrs = request.form.getlist("annexure_manufacturer[]")
+            annexure_marks = request.form.getlist("annexure_markings[]")
+            annexure_yoms = request.form.getlist("annexure_yom[]")
+            annexure_unit_vals = request.form.getlist("annexure_unit_invoice_value[]")
+            annexure_total_vals = request.form.getlist("annexure_total_invoice_value[]")
+
+            rows = [
+                dict(
                     inspection_id=i.id,
-                    sno=(int(annexure_snos[idx]) if annexure_snos[idx] else None),
-                    description=annexure_descs[idx],
-                    qty=(int(annexure_qtys[idx]) if annexure_qtys[idx] else None),
-                    manufacturer=annexure_mfrs[idx] if idx < len(annexure_mfrs) else None,
-                    markings=annexure_marks[idx] if idx < len(annexure_marks) else None,
-                    yom=(int(annexure_yoms[idx]) if idx < len(annexure_yoms) and annexure_yoms[idx] else None),
-                    unit_invoice_value=(float(annexure_unit_vals[idx]) if idx < len(annexure_unit_vals) and annexure_unit_vals[idx] else None),
-                    total_invoice_value=(float(annexure_total_vals[idx]) if idx < len(annexure_total_vals) and annexure_total_vals[idx] else None),
+                    sno=(int(sno) if sno else None),
+                    description=desc,
+                    qty=(int(qty) if qty else None),
+                    manufacturer=mfr,
+                    markings=mark,
+                    yom=(int(yom) if yom else None),
+                    unit_invoice_value=(float(unit_val) if unit_val else None),
+                    total_invoice_value=(float(total_val) if total_val else None),
                 )
-                db.session.add(a)
-        db.session.commit()
-    # ===== End Annexure handling =====
+                for sno, desc, qty, mfr, mark, yom, unit_val, total_val in zip_longest(
+                    annexure_snos, annexure_descs, annexure_qtys, annexure_mfrs, annexure_marks,
+                    annexure_yoms, annexure_unit_vals, annexure_total_vals)
+                if desc and desc.strip()  # only save if description is filled
+            ]
+            if rows:
+                # one executemany INSERT instead of a unit-of-work INSERT per row
+                db.session.execute(Annexure.__table__.insert(), rows)
+        # ===== End Annexure handling =====
 
     flash("Inspection created.", "success")
     return redirect(url_for("inspection_detail", inspection_id=i.id))
@@ -668,11 +1032,18 @@ def inspection_create():
 @app.route("/inspections/<int:inspection_id>")
 @role_required(Role.ADMIN, Role.ENGINEER, Role.ACCOUNTANT)
 def inspection_detail(inspection_id):
-    i = Inspection.query.get_or_404(inspection_id)
-    rep = Report.query.filter_by(inspection_id=inspection_id).first()
-    inv = Invoice.query.filter_by(inspection_id=inspection_id).first()
-    latest_file = ReportFile.query.filter_by(inspection_id=inspection_id).order_by(ReportFile.uploaded_at.desc()).first()
-    return render_template("inspection_detail.html", i=i, rep=rep, inv=inv, latest_file=latest_file)
+    # one joined SELECT for the inspection and its one-to-one relations
+    i = Inspection.query.options(
+        *INSPECTION_REFS, joinedload(Inspection.report), joinedload(Inspection.invoice),
+    ).get_or_404(inspection_id)
+    # only the columns the upload panel shows, read off ix_reportfile_inspection_uploaded
+    latest_file = db.session.execute(
+        db.select(ReportFile.id, ReportFile.original_name, ReportFile.mimetype, ReportFile.uploaded_at)
+        .where(ReportFile.inspection_id == i.id)
+        .order_by(ReportFile.uploaded_at.desc()).limit(1)
+    ).first()
+    return render_template("inspection_detail.html", i=i, rep=i.report, inv=i.invoice, latest_file=latest_file,
+                           engineers=engineers_list())
 
 # engineer can also update CHA for their own inspection
 @app.route("/inspections/<int:inspection_id>/edit", methods=["GET","POST"])
@@ -683,12 +1054,13 @@ def inspection_edit(inspection_id):
         flash("Unauthorized.", "danger"); return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
     if request.method == "POST":
+        depr_inputs = (i.date, i.year_of_manufacture, i.original_cif_value)
         i.date = datetime.fromisoformat(request.form["date"])
         i.client_id = int(request.form["client_id"])
         i.location = request.form.get("location","")
         i.asset = request.form.get("asset","")
         i.forwarder_name = request.form.get("forwarder_name","").strip() or None
-        i.cha_commission_pct = (float(request.form.get("cha_commission_pct")) if request.form.get("cha_commission_pct") else None)
+        i.cha_commission_pct = form_float("cha_commission_pct")
 
         # Allow both roles to update CHA (engineer only on their own inspection)
         if request.form.get("cha_id") is not None:
@@ -700,42 +1072,22 @@ def inspection_edit(inspection_id):
             i.inspection_type = request.form.get("inspection_type", i.inspection_type)
 
         # type-specific updates
-        t = i.inspection_type
-        if t == InspectionType.PSIC:
-            i.scrap_type = request.form.get("scrap_type") or None
-            i.container_count = (int(request.form.get("container_count")) if request.form.get("container_count") else None)
-            i.container_weight = (float(request.form.get("container_weight")) if request.form.get("container_weight") else None)
-            i.container_notes = request.form.get("container_notes") or None
-
-        elif t == InspectionType.CE_VAL:
-            i.machinery_type = request.form.get("machinery_type") or None
-            i.year_of_manufacture = (int(request.form.get("year_of_manufacture")) if request.form.get("year_of_manufacture") else None)
-            i.original_cif_value = (float(request.form.get("original_cif_value")) if request.form.get("original_cif_value") else None)
-            dep_pct = compute_depreciation_pct(i.year_of_manufacture or 0, i.date)
-            i.depreciation_pct = dep_pct
-            if i.original_cif_value is not None:
-                i.residual_value = round(max(0.0, (i.original_cif_value or 0.0) * (1 - dep_pct/100.0)), 2)
-            i.balance_useful_life = request.form.get("balance_useful_life") or None
-
-        elif t == InspectionType.CE_FIT:
-            i.goods_details = request.form.get("goods_details") or None
-            i.condition_notes = request.form.get("condition_notes") or None
-            i.fair_market_value = (float(request.form.get("fair_market_value")) if request.form.get("fair_market_value") else None)
-
-        # ensure public id exists (e.g., if previously legacy entry)
-        if not i.public_id:
-            generate_public_id(i)
+        apply_type_fields(i)
+        if i.inspection_type == InspectionType.CE_VAL:
+            # only recompute when an input changed (or it was never computed, e.g. type just switched)
+            if (i.date, i.year_of_manufacture, i.original_cif_value) != depr_inputs or i.depreciation_pct is None:
+                dep_pct = compute_depreciation_pct(i.year_of_manufacture or 0, i.date)
+                i.depreciation_pct = dep_pct
+                if i.original_cif_value is not None:
+                    i.residual_value = residual_value(i.original_cif_value, dep_pct)
 
         db.session.commit()
         flash("Inspection updated.", "success")
         return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
-    clients = Client.query.order_by(Client.name.asc()).all()
-    chas = CHA.query.order_by(CHA.name.asc()).all()
-    engineers = User.query.filter(User.role == Role.ENGINEER).all()
-    logs = AuditLog.query.filter_by(entity="inspection", entity_id=i.id)\
-                     .order_by(AuditLog.created_at.desc())\
-                     .limit(20).all()
+    clients = clients_lookup()
+    chas = chas_lookup()
+    engineers = engineers_list()
     return render_template("inspection_edit.html", i=i, clients=clients, chas=chas, engineers=engineers)
 
 # admin delete inspection (cleans dependents)
@@ -743,20 +1095,19 @@ def inspection_edit(inspection_id):
 @role_required(Role.ADMIN)
 def inspection_delete(inspection_id):
     i = Inspection.query.get_or_404(inspection_id)
-    Report.query.filter_by(inspection_id=inspection_id).delete()
-    Invoice.query.filter_by(inspection_id=inspection_id).delete()
-    Commission.query.filter_by(inspection_id=inspection_id).delete()
-    # delete files
-    files = ReportFile.query.filter_by(inspection_id=inspection_id).all()
-    for f in files:
+    # only the stored names are needed; the rows go with the inspection via ON DELETE CASCADE
+    paths = [UPLOAD_ROOT / name for (name,) in
+             db.session.query(ReportFile.stored_name).filter_by(inspection_id=inspection_id)]
+    # report / invoice / commission / files / annexures are removed by the database
+    db.session.delete(i)
+    log_action("delete", "inspection", inspection_id)
+    db.session.commit()
+    # unlink only once the delete is committed, so a failed commit can't orphan rows from their files
+    for path in paths:
         try:
-            (UPLOAD_ROOT / f.stored_name).unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
         except Exception:
             pass
-        db.session.delete(f)
-    db.session.delete(i)
-    db.session.commit()
-    log_action("delete", "inspection", inspection_id)
     flash("Inspection deleted.", "info")
     return redirect(url_for("dashboard"))
 
@@ -767,8 +1118,8 @@ def inspection_status(inspection_id):
     if session.get("role") == Role.ENGINEER and i.engineer_id != session.get("user_id"):
         flash("Unauthorized.", "danger"); return redirect(url_for("inspection_detail", inspection_id=inspection_id))
     i.status = request.form["status"]
-    db.session.commit()
     log_action("status", "inspection", inspection_id, changes={"status": i.status})
+    db.session.commit()
     flash("Status updated.", "success")
     return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
@@ -777,16 +1128,33 @@ def inspection_status(inspection_id):
 def assign_engineer(inspection_id):
     i = Inspection.query.get_or_404(inspection_id)
     i.engineer_id = int(request.form["engineer_id"]) if request.form.get("engineer_id") else None
-    db.session.commit()
     log_action("assign", "inspection", inspection_id, changes={"engineer_id": i.engineer_id})
+    db.session.commit()
     flash("Engineer assigned.", "success")
     return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
 # ===== Reports =====
+def attach_report_file(i, rep, stored, original_name, mimetype):
+    """Record an uploaded report file and mark the inspection/report as uploaded (caller commits)."""
+    rf = ReportFile(
+        inspection_id=i.id,
+        uploader_id=session.get("user_id"),
+        stored_name=stored,
+        original_name=original_name,
+        mimetype=mimetype
+    )
+    db.session.add(rf)
+    # auto status update
+    i.status = InspectionStatus.REPORT_UPLOADED
+    # mark report as final for clarity if body exists
+    rep.status = ReportStatus.FINAL
+    rep.updated_at = datetime.utcnow()
+    return rf
+
 @app.route("/reports/<int:inspection_id>/edit", methods=["GET","POST"])
 @role_required(Role.ADMIN, Role.ENGINEER)
 def report_edit(inspection_id):
-    i = Inspection.query.get_or_404(inspection_id)
+    i = Inspection.query.options(*INSPECTION_REFS).get_or_404(inspection_id)
     rep = ensure_report(inspection_id)
     if request.method == "POST":
         # File upload path
@@ -795,23 +1163,10 @@ def report_edit(inspection_id):
             if not allowed_report_file(file.filename):
                 flash("Invalid file type. Allowed: PDF, DOC, DOCX.", "warning")
                 return redirect(url_for("report_edit", inspection_id=inspection_id))
-            safe = secure_filename(file.filename)
-            stored = f"{inspection_id}_{int(datetime.utcnow().timestamp())}_{safe}"
+            stored = stored_report_name(inspection_id, file.filename)
             save_path = UPLOAD_ROOT / stored
-            file.save(save_path)
-            rf = ReportFile(
-                inspection_id=inspection_id,
-                uploader_id=session.get("user_id"),
-                stored_name=stored,
-                original_name=file.filename,
-                mimetype=file.mimetype
-            )
-            db.session.add(rf)
-            # auto status update
-            i.status = InspectionStatus.REPORT_UPLOADED
-            # mark report as final for clarity if body exists
-            rep.status = ReportStatus.FINAL
-            rep.updated_at = datetime.utcnow()
+            save_upload(file, save_path)
+            attach_report_file(i, rep, stored, file.filename, file.mimetype)
             db.session.commit()
             flash("Report uploaded.", "success")
             return redirect(url_for("inspection_detail", inspection_id=inspection_id))
@@ -819,14 +1174,16 @@ def report_edit(inspection_id):
         action = request.form.get("action")
         body = request.form.get("body", "")
         if action == "ai":
-            t = Template.query.filter_by(active=True).first()
-            if t and t.html_snippet:
-                body = (t.html_snippet
-                        .replace("{{client}}", i.client.name if i.client else "")
-                        .replace("{{location}}", i.location or "")
-                        .replace("{{asset}}", i.asset or "")
-                        .replace("{{engineer}}", i.engineer.name if i.engineer else "")
-                        .replace("{{findings}}", "All primary checks completed. No critical deviations."))
+            compiled = get_active_template()
+            if compiled:
+                # single-pass substitution into the precompiled snippet
+                body = compiled.format_map(defaultdict(str,
+                    client=i.client.name if i.client else "",
+                    location=i.location or "",
+                    asset=i.asset or "",
+                    engineer=i.engineer.name if i.engineer else "",
+                    findings="All primary checks completed. No critical deviations.",
+                ))
         rep.body = body
         if request.form.get("save_as") == "final":
             rep.status = ReportStatus.FINAL
@@ -839,29 +1196,31 @@ def report_edit(inspection_id):
         db.session.commit()
         flash("Report saved.", "success")
         return redirect(url_for("inspection_detail", inspection_id=inspection_id))
-    latest_file = ReportFile.query.filter_by(inspection_id=inspection_id).order_by(ReportFile.uploaded_at.desc()).first()
-    return render_template("report_edit.html", i=i, rep=rep, latest_file=latest_file)
+    return render_template("report_edit.html", i=i, rep=rep)
 
-from flask import render_template_string
+# compiled Jinja template per report body; keyed by the source string, so an edited body is simply a new key
+@lru_cache(maxsize=256)
+def compile_report_body(body: str):
+    return app.jinja_env.from_string(body)
 
 @app.route("/inspections/<int:inspection_id>/report/view")
 @role_required(Role.ADMIN, Role.ENGINEER, Role.ACCOUNTANT)
 def report_view(inspection_id):
-    i = Inspection.query.get_or_404(inspection_id)
+    i = Inspection.query.options(*INSPECTION_REFS).get_or_404(inspection_id)
     rep = Report.query.filter_by(inspection_id=inspection_id).first()
 
     if not rep or not rep.body:
         return render_template("report_view.html", i=i, rep=rep)
 
     # Render template placeholders with inspection values
-    rendered_body = render_template_string(rep.body, i=i)
+    rendered_body = render_template(compile_report_body(rep.body), i=i)
 
     return render_template("report_view.html", i=i, rep=rep, rendered_body=rendered_body)
 
 @app.route("/inspections/<int:inspection_id>/report/export")
 @role_required(Role.ADMIN, Role.ENGINEER, Role.ACCOUNTANT)
 def report_export(inspection_id):
-    i = Inspection.query.get_or_404(inspection_id)
+    i = Inspection.query.options(*INSPECTION_REFS).get_or_404(inspection_id)
 
     # Choose template based on inspection type
     if i.inspection_type == InspectionType.PSIC:
@@ -874,10 +1233,36 @@ def report_export(inspection_id):
 
     return render_template(template_name, i=i)
 
+# Raw upload for scripts/large files: body is the file itself (application/octet-stream),
+# name in X-Filename. Skips Werkzeug's multipart parser and never buffers the whole file.
+@app.route("/inspections/<int:inspection_id>/upload_stream", methods=["POST"])
+@role_required(Role.ADMIN, Role.ENGINEER)
+def report_upload_stream(inspection_id):
+    i = Inspection.query.get_or_404(inspection_id)
+    if request.mimetype != "application/octet-stream":
+        return jsonify(error="Send the file as application/octet-stream."), 415
+    filename = unquote(request.headers.get("X-Filename", ""))
+    if not allowed_report_file(filename):
+        return jsonify(error="Invalid file type. Allowed: PDF, DOC, DOCX."), 400
+    rep = ensure_report(inspection_id)
+    stored = stored_report_name(inspection_id, filename)
+    save_path = UPLOAD_ROOT / stored
+    try:
+        with open(save_path, "wb") as dst:
+            shutil.copyfileobj(request.stream, dst, length=1 << 20)
+    except Exception:
+        save_path.unlink(missing_ok=True)
+        raise
+    rf = attach_report_file(i, rep, stored, filename, mimetypes.guess_type(filename)[0])
+    db.session.commit()
+    return jsonify(id=rf.id, stored_name=stored), 201
+
 @app.route("/reports/download/<int:file_id>")
 @role_required(Role.ADMIN, Role.ENGINEER, Role.ACCOUNTANT)
 def report_download(file_id):
-    f = ReportFile.query.get_or_404(file_id)
+    f = db.session.execute(
+        db.select(ReportFile.stored_name, ReportFile.original_name).where(ReportFile.id == file_id)
+    ).first() or abort(404)
     return send_from_directory(app.config["UPLOAD_FOLDER"], f.stored_name, as_attachment=True, download_name=f.original_name)
 
 # ===== Report Library (Admin only) =====
@@ -889,7 +1274,18 @@ def report_library():
     date_from = request.args.get("from")
     date_to = request.args.get("to")
 
-    qry = db.session.query(ReportFile, Inspection, Client).join(Inspection, ReportFile.inspection_id == Inspection.id).join(Client, Inspection.client_id == Client.id)
+    # ReportFile rows with inspection + client from the filter joins and engineer / CHA eager-loaded:
+    # one SELECT for the whole page (the relations raise on lazy SQL)
+    qry = (
+        ReportFile.query
+        .join(ReportFile.inspection).join(Inspection.client)
+        .options(
+            contains_eager(ReportFile.inspection).contains_eager(Inspection.client),
+            contains_eager(ReportFile.inspection).joinedload(Inspection.engineer),
+            contains_eager(ReportFile.inspection).joinedload(Inspection.cha),
+            *strict_loading(),
+        )
+    )
 
     if q:
         like = f"%{q}%"
@@ -919,46 +1315,72 @@ def invoice_edit(inspection_id):
     i = Inspection.query.get_or_404(inspection_id)
     inv = ensure_invoice(inspection_id)
     if request.method == "POST":
-        inv.fee = float(request.form.get("fee", inv.fee or 0))
-        inv.tax_pct = float(request.form.get("tax_pct", inv.tax_pct or 0))
+        try:
+            fee = finite_float(request.form.get("fee", inv.fee or 0))
+            tax_pct = finite_float(request.form.get("tax_pct", inv.tax_pct or 0))
+        except ValueError:
+            flash("Invalid amount.", "warning")
+            return redirect(url_for("invoice_edit", inspection_id=inspection_id))
+        inv.fee, inv.tax_pct = fee, tax_pct
         inv.total = calc_total(inv.fee, inv.tax_pct)
         inv.status = request.form.get("status", inv.status)
         inv.notes = request.form.get("notes", inv.notes)
         if inv.status in [InvoiceStatus.SENT, InvoiceStatus.PAID]:
             i.status = InspectionStatus.INVOICED
-        db.session.commit()
-        # recalc commission automatically if override / CHA rate present
-        upsert_commission_from_inspection(i)
+        # recalc commission automatically if override / CHA rate present; commits the invoice too
+        upsert_commission_from_inspection(i, fee=inv.fee)
         flash("Invoice updated.", "success")
         return redirect(url_for("inspection_detail", inspection_id=inspection_id))
     return render_template("invoice_edit.html", i=i, inv=inv)
 
+# recompute every invoice total (e.g. after a tax rule change): one read, one executemany UPDATE
+@app.route("/invoices/recompute", methods=["POST"])
+@role_required(Role.ADMIN)
+def invoices_recompute():
+    rows = db.session.query(Invoice.id, Invoice.fee, Invoice.tax_pct).all()
+    if rows:
+        totals = calc_totals_bulk([r.fee for r in rows], [r.tax_pct for r in rows])
+        db.session.execute(update(Invoice), [{"id": r.id, "total": t} for r, t in zip(rows, totals)])
+        db.session.commit()
+    flash(f"Recomputed {len(rows)} invoice totals.", "success")
+    return redirect(url_for("dashboard"))
+
 # ===== Commissions / CHA Tracker =====
 @app.route("/cha-tracker")
 @role_required(Role.ADMIN, Role.ACCOUNTANT)
 def cha_tracker():
+    # one SELECT; innerjoin keeps the old "only rows with an inspection and a CHA" semantics
     rows = (
-        db.session.query(Commission, Inspection, CHA)
-        .join(Inspection, Commission.inspection_id == Inspection.id)
-        .join(CHA, Commission.cha_id == CHA.id)
-        .all()
-    )
-    summary = (
-        db.session.query(CHA.name, Commission.status, func.sum(Commission.amount))
-        .join(Commission, Commission.cha_id == CHA.id)
-        .group_by(CHA.name, Commission.status)
+        Commission.query
+        .options(joinedload(Commission.inspection, innerjoin=True).joinedload(Inspection.client),
+                 joinedload(Commission.cha, innerjoin=True), *strict_loading())
         .all()
     )
+    # per (CHA name, status) totals from the rows above, summed in paise; no second GROUP BY scan
+    totals = defaultdict(int)
+    for c in rows:
+        totals[(c.cha.name, c.status)] += to_paise(c.amount)
+    summary = [(name, st, paise / 100) for (name, st), paise
+               in sorted(totals.items(), key=lambda kv: (kv[0][0], kv[0][1] or ""))]
     return render_template("cha.html", rows=rows, summary=summary)
 
+# recalc every existing commission (e.g. after CHA rate changes): one read, one upsert
+@app.route("/commissions/recompute", methods=["POST"])
+@role_required(Role.ADMIN, Role.ACCOUNTANT)
+def commissions_recompute():
+    n = bulk_upsert_commissions(r.inspection_id for r in db.session.query(Commission.inspection_id))
+    flash(f"Recomputed {n} commissions.", "success")
+    return redirect(url_for("cha_tracker"))
+
 # generate / recalc from invoice × rate (respect override if present)
 @app.route("/commissions/generate/<int:inspection_id>", methods=["POST"])
 @role_required(Role.ADMIN, Role.ACCOUNTANT)
 def commission_generate(inspection_id):
     i = Inspection.query.get_or_404(inspection_id)
-    if not i.cha and i.cha_commission_pct is None:
+    if not i.cha_id and i.cha_commission_pct is None:
         flash("No CHA or commission % provided.", "warning"); return redirect(url_for("inspection_detail", inspection_id=inspection_id))
-    upsert_commission_from_inspection(i)
+    fee = db.session.query(Invoice.fee).filter_by(inspection_id=inspection_id).scalar()
+    upsert_commission_from_inspection(i, fee)
     flash("Commission calculated.", "success")
     return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
@@ -978,11 +1400,11 @@ def commission_update(commission_id):
     com = Commission.query.get_or_404(commission_id)
     amt_raw = request.form.get("amount", "").strip()
     try:
-        amount = float(amt_raw)
+        amount = finite_float(amt_raw)
     except (TypeError, ValueError):
         flash("Invalid amount.", "warning")
         return redirect(url_for("cha_tracker"))
-    com.amount = round(max(0.0, amount), 2)
+    com.amount = max(0, to_paise(amount)) / 100
     db.session.commit()
     flash("Commission amount updated.", "success")
     return redirect(url_for("cha_tracker"))
@@ -993,43 +1415,77 @@ def commission_update(commission_id):
 def templates_mgmt():
     if request.method == "POST":
         if "create" in request.form:
+            html_snippet = request.form.get("html_snippet","")
             db.session.add(Template(
                 name=request.form["name"],
                 active=("active" in request.form),
                 ai_prompt=request.form.get("ai_prompt",""),
-                html_snippet=request.form.get("html_snippet","")
+                html_snippet=html_snippet,
+                html_snippet_compiled=compile_snippet(html_snippet),
             ))
         elif "toggle" in request.form:
             t = Template.query.get(int(request.form["template_id"]))
             t.active = not t.active
         db.session.commit()
+        invalidate_lookup("active_template")
         return redirect(url_for("templates_mgmt"))
-    templates = Template.query.order_by(Template.active.desc(), Template.name.asc()).all()
+    # the table only shows name/active; leave the prompt and snippet bodies in the db
+    templates = db.session.execute(
+        db.select(Template.id, Template.name, Template.active)
+        .order_by(Template.active.desc(), Template.name.asc())
+    ).all()
     return render_template("templates.html", templates=templates)
 
 # ===== Notifications =====
 @app.route("/notifications")
 @role_required(Role.ADMIN, Role.ENGINEER, Role.ACCOUNTANT)
 def notifications():
-    overdue_reports = Inspection.query.filter(
+    # all three lists come back from one UNION ALL as (kind, inspection_id, date, client_name, amount) rows
+    def inspection_rows(kind):
+        return (
+            select(literal(kind).label("kind"), Inspection.id.label("inspection_id"), Inspection.date,
+                   Client.name.label("client_name"), literal(None, db.Float).label("amount"))
+            .select_from(Inspection)
+            .outerjoin(Client, Inspection.client_id == Client.id)
+        )
+    overdue = inspection_rows("overdue").where(
         Inspection.status == InspectionStatus.COMPLETED,
-        Inspection.date < datetime.utcnow() - timedelta(days=3)
-    ).all()
-    missing_invoice = Inspection.query.filter(
-        Inspection.status.in_([InspectionStatus.COMPLETED, InspectionStatus.REPORT_UPLOADED])
-    ).filter(~Inspection.id.in_(db.session.query(Invoice.inspection_id))).all()
-    commission_due = Commission.query.filter(Commission.status == CommissionStatus.DUE).all()
+        Inspection.date < datetime.utcnow() - timedelta(days=3),
+    )
+    # anti-join (LEFT JOIN ... IS NULL) rather than NOT IN (subquery)
+    missing = (
+        inspection_rows("missing")
+        .outerjoin(Invoice, Invoice.inspection_id == Inspection.id)
+        .where(Invoice.id.is_(None),
+               Inspection.status.in_([InspectionStatus.COMPLETED, InspectionStatus.REPORT_UPLOADED]))
+    )
+    due = select(literal("due"), Commission.inspection_id, literal(None, db.DateTime),
+                 literal(None, db.String), Commission.amount).where(Commission.status == CommissionStatus.DUE)
+    groups = {"overdue": [], "missing": [], "due": []}
+    for row in db.session.execute(union_all(overdue, missing, due)):
+        groups[row.kind].append(row)
+    overdue_reports, missing_invoice, commission_due = groups["overdue"], groups["missing"], groups["due"]
     return render_template("notifications.html",
                            overdue_reports=overdue_reports,
                            missing_invoice=missing_invoice,
                            commission_due=commission_due)
 
 # ===== Lightweight auto-migration for SQLite (adds new columns if missing) =====
+def _schema_fingerprint(engine):
+    """31-bit checksum of the models' DDL; stored in PRAGMA user_version once a database matches it."""
+    ddl = [str(CreateTable(t).compile(engine)) for t in db.metadata.sorted_tables]
+    ddl += sorted(str(CreateIndex(i).compile(engine)) for t in db.metadata.sorted_tables for i in t.indexes)
+    return zlib.crc32("\n".join(ddl).encode()) & 0x7FFFFFFF
+
 def _ensure_sqlite_columns():
-    import sqlite3
     engine = db.get_engine()
-    if "sqlite" not in str(engine.url):
+    if engine.dialect.name != "sqlite":
         return
+    # normal boots: the database was already migrated to these models, nothing to inspect
+    fingerprint = _schema_fingerprint(engine)
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() == fingerprint:
+            return
     con = engine.raw_connection()
     cur = con.cursor()
     def table_cols(table):
@@ -1056,13 +1512,75 @@ def _ensure_sqlite_columns():
         ("inspection","goods_details","TEXT"),
         ("inspection","condition_notes","TEXT"),
         ("inspection","fair_market_value","REAL"),
+        ("template","html_snippet_compiled","TEXT"),
     }
-    cols = table_cols("inspection")
+    cols = {tbl: table_cols(tbl) for tbl in {t for t, _, _ in want}}
+    cur.execute("BEGIN")  # all ALTERs in one transaction: one commit
     for tbl, col, typ in want:
-        if col not in cols:
+        if col not in cols[tbl]:
             cur.execute(f"ALTER TABLE {tbl} ADD COLUMN {col} {typ}")
     con.commit()
-    cur.close(); con.close()
+
+    # SQLite can't ALTER a foreign key, so tables created before the ON DELETE rules
+    # were declared on the models are rebuilt once (new table, copy rows, swap).
+    # The whole pass is one transaction (sqlite3 would autocommit each CREATE TABLE otherwise), so a
+    # failed copy rolls back cleanly and the next boot retries instead of tripping over a half-built table.
+    cur.execute("PRAGMA foreign_keys=OFF")  # no-op inside a transaction, so set it first
+    cur.execute("BEGIN")
+    try:
+        for table in db.metadata.sorted_tables:
+            have = table_cols(table.name)
+            if not have:
+                continue
+            want_fks = {(fk.parent.name, (fk.ondelete or "NO ACTION").upper()) for fk in table.foreign_keys}
+            cur.execute(f'PRAGMA foreign_key_list("{table.name}")')
+            if want_fks == {(row[3], row[6].upper()) for row in cur.fetchall()}:
+                continue
+            tmp = f"{table.name}__rebuild"
+            ddl = str(CreateTable(table).compile(engine)).replace(
+                f"CREATE TABLE {engine.dialect.identifier_preparer.quote(table.name)} (", f'CREATE TABLE "{tmp}" (', 1)
+            copied = [c for c in table.columns if c.name in have]
+            names = ", ".join(f'"{c.name}"' for c in copied)
+            # columns added by the ALTERs above are NULL on old rows; fill NOT NULL ones from the model default
+            exprs, params = [], []
+            for c in copied:
+                if not c.nullable and not c.primary_key and c.default is not None and c.default.is_scalar:
+                    exprs.append(f'COALESCE("{c.name}", ?)'); params.append(c.default.arg)
+                else:
+                    exprs.append(f'"{c.name}"')
+            cur.execute(f'DROP TABLE IF EXISTS "{tmp}"')
+            cur.execute(ddl)
+            cur.execute(f'INSERT INTO "{tmp}" ({names}) SELECT {", ".join(exprs)} FROM "{table.name}"', params)
+            cur.execute(f'DROP TABLE "{table.name}"')
+            cur.execute(f'ALTER TABLE "{tmp}" RENAME TO "{table.name}"')
+            # old rows may point at parents that are long gone; apply the declared rule to them now
+            for fk in table.foreign_keys:
+                parent = fk.column.table.name
+                orphan = f'"{fk.parent.name}" IS NOT NULL AND "{fk.parent.name}" NOT IN (SELECT "{fk.column.name}" FROM "{parent}")'
+                if fk.ondelete == "CASCADE":
+                    cur.execute(f'DELETE FROM "{table.name}" WHERE {orphan}')
+                elif fk.ondelete == "SET NULL":
+                    cur.execute(f'UPDATE "{table.name}" SET "{fk.parent.name}" = NULL WHERE {orphan}')
+            app.logger.info(f"Rebuilt table {table.name} with current foreign keys")
+        con.commit()
+    except sqlite3.DatabaseError as e:
+        con.rollback()
+        app.logger.warning(f"Foreign key rebuild skipped, old tables kept: {e}")
+        return  # leave user_version alone so the next boot retries
+    finally:
+        cur.execute("PRAGMA foreign_keys=ON")
+        cur.close(); con.close()
+
+    # create_all() skips indexes on tables that already exist, so add any missing ones here
+    for table in db.metadata.sorted_tables:
+        for idx in table.indexes:
+            try:
+                idx.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                app.logger.warning(f"Index {idx.name} not created: {e}")
+                return  # leave user_version alone so the next boot retries
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {fingerprint}")
 
 @app.route("/inspections/<int:inspection_id>/annexures/add", methods=["POST"])
 @role_required(Role.ADMIN, Role.ENGINEER)
@@ -1071,22 +1589,25 @@ def annexure_add(inspection_id):
 
     a = Annexure(
         inspection_id=inspection_id,
-        sno=(int(request.form.get("sno")) if request.form.get("sno") else None),
+        sno=form_int("sno"),
         description=request.form.get("description") or None,
-        qty=(int(request.form.get("qty")) if request.form.get("qty") else None),
+        qty=form_int("qty"),
         manufacturer=request.form.get("manufacturer") or None,
         markings=request.form.get("markings") or None,
-        yom=(int(request.form.get("yom")) if request.form.get("yom") else None),
-        unit_invoice_value=(float(request.form.get("unit_invoice_value")) if request.form.get("unit_invoice_value") else None),
-        total_invoice_value=(float(request.form.get("total_invoice_value")) if request.form.get("total_invoice_value") else None),
-        unit_fob_price=(float(request.form.get("unit_fob_price")) if request.form.get("unit_fob_price") else None),
-        unit_present_assessed_value=(float(request.form.get("unit_present_assessed_value")) if request.form.get("unit_present_assessed_value") else None),
-        total_present_assessed_value=(float(request.form.get("total_present_assessed_value")) if request.form.get("total_present_assessed_value") else None),
+        yom=form_int("yom"),
+        unit_invoice_value=form_float("unit_invoice_value"),
+        total_invoice_value=form_float("total_invoice_value"),
+        unit_fob_price=form_float("unit_fob_price"),
+        unit_present_assessed_value=form_float("unit_present_assessed_value"),
+        total_present_assessed_value=form_float("total_present_assessed_value"),
     )
 
     db.session.add(a)
+    # only the fields that were actually filled in, as parsed onto the row
+    fields = {c.name: v for c in Annexure.__table__.columns
+              if c.name not in ("id", "inspection_id") and (v := getattr(a, c.name)) is not None}
+    log_action("annexure_add", "inspection", inspection_id, changes={"annexure": fields})
     db.session.commit()
-    log_action("annexure_add", "inspection", inspection_id, changes={"annexure": request.form.to_dict(flat=True)})
     flash("Annexure row added.", "success")
     return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
@@ -1096,8 +1617,9 @@ def annexure_add(inspection_id):
 def annexure_delete(annexure_id):
     a = Annexure.query.get_or_404(annexure_id)
     inspection_id = a.inspection_id
-    db.session.delete(a); db.session.commit()
+    db.session.delete(a)
     log_action("annexure_delete", "inspection", inspection_id, changes={"annexure_id": annexure_id})
+    db.session.commit()
     flash("Annexure row deleted.", "info")
     return redirect(url_for("inspection_detail", inspection_id=inspection_id))
 
@@ -1106,4 +1628,5 @@ if __name__ == "__main__":
     with app.app_context():
         db.create_all()
         _ensure_sqlite_columns()
+        backfill_public_ids()
     app.run(debug=True)
\ No newline at end of file
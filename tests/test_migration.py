@@ -0,0 +1,84 @@
+"""Boot-time SQLite migration (_ensure_sqlite_columns) against a legacy-shaped ims.db.
+
+Each test copies app.py into a scratch directory, writes an old-schema database into its
+instance/ folder and boots the app there in a subprocess (the database URI is fixed at import).
+Run with: python -m unittest discover -s tests
+"""
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# inspection as it looked before inspection_type / the type-specific columns / ON DELETE rules
+LEGACY_SCHEMA = """
+CREATE TABLE client (id INTEGER PRIMARY KEY, name VARCHAR(160) NOT NULL, gst_number VARCHAR(40),
+                     billing_address TEXT);
+CREATE TABLE inspection (id INTEGER PRIMARY KEY, date DATETIME, client_id INTEGER REFERENCES client(id),
+                         location VARCHAR(200), asset VARCHAR(200), cha_id INTEGER, status VARCHAR(30),
+                         engineer_id INTEGER, created_at DATETIME);
+INSERT INTO client (id, name) VALUES (1, 'Acme');
+INSERT INTO inspection (id, date, client_id, status) VALUES (1, '2024-01-10 10:00:00.000000', 1, 'DRAFT');
+INSERT INTO inspection (id, date, client_id, status) VALUES (2, '2024-02-10 10:00:00.000000', 99, 'DRAFT');
+"""
+
+BOOT = """
+import app as m
+with m.app.app_context():
+    m.db.create_all()
+    m._ensure_sqlite_columns()
+"""
+
+
+class LegacyMigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        shutil.copy(ROOT / "app.py", self.dir)
+        (self.dir / "instance").mkdir()
+        self.db = self.dir / "instance" / "ims.db"
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def legacy_db(self, extra=""):
+        con = sqlite3.connect(self.db)
+        con.executescript(LEGACY_SCHEMA + extra)
+        con.close()
+
+    def boot(self):
+        res = subprocess.run([sys.executable, "-c", BOOT], cwd=self.dir, capture_output=True, text=True)
+        self.assertEqual(res.returncode, 0, res.stderr)
+
+    def query(self, sql):
+        con = sqlite3.connect(self.db)
+        try:
+            return con.execute(sql).fetchall()
+        finally:
+            con.close()
+
+    def test_rebuild_fills_not_null_columns_added_by_alter(self):
+        self.legacy_db()
+        self.boot()
+        self.assertEqual(self.query("SELECT id, inspection_type, client_id FROM inspection ORDER BY id"),
+                         [(1, "PSIC", 1), (2, "PSIC", None)])
+        fks = {row[3]: row[6] for row in self.query("PRAGMA foreign_key_list(inspection)")}
+        self.assertEqual(fks["client_id"], "SET NULL")
+        self.assertNotEqual(self.query("PRAGMA user_version"), [(0,)])
+        self.boot()  # second boot: already migrated
+
+    def test_failed_rebuild_rolls_back_and_boot_still_works(self):
+        # a NULL in a NOT NULL column with no literal default cannot be copied
+        self.legacy_db("INSERT INTO inspection (id, date, client_id) VALUES (3, NULL, 1);")
+        self.boot()
+        self.boot()  # no half-built inspection__rebuild left to trip over
+        self.assertEqual(self.query("SELECT name FROM sqlite_master WHERE name LIKE '%__rebuild'"), [])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM inspection"), [(3,)])
+        self.assertEqual(self.query("PRAGMA user_version"), [(0,)])  # retried on the next boot
+
+
+if __name__ == "__main__":
+    unittest.main()